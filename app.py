@@ -1,74 +1,220 @@
+import numpy as np
 import pandas as pd
 import os
 import plotly.io as pio
 import plotly.graph_objects as go
 import dash
 from dash import dcc, html, Input, Output
+from dash.exceptions import PreventUpdate
+from flask_caching import Cache
 import base64
+import contextlib
+import functools
+import hashlib
+import pickle
+import tempfile
 
 external_stylesheets = ["https://codepen.io/chriddyp/pen/bWLwgP.css"]
 
-# Load image safely with fallback
-image_path = os.path.join("data", "aei_logo.png")
-encoded_image = None
+pio.templates.default = "plotly_white"
+
+CURR_PATH = os.path.abspath(os.path.dirname(__file__))
+
+# Load image safely with fallback; the full data URI is built once at import and reused by the layout
+image_path = os.path.join(CURR_PATH, "data", "aei_logo.png")
+LOGO_URI = ""
 if os.path.exists(image_path):
     with open(image_path, 'rb') as img_file:
-        encoded_image = base64.b64encode(img_file.read()).decode()
+        LOGO_URI = "data:image/png;base64," + base64.b64encode(img_file.read()).decode()
 
-pio.templates.default = "plotly_white"
+POLICY_TYPES = {
+    "cl": "CL",
+    "biden": "Biden",
+    "wnm": "WNM",
+    "fsa": "Romney",
+    "house25": "House25",
+    "senate25": "Senate25"
+}
 
-CURR_PATH = os.path.abspath(os.path.dirname(__file__))
+# Fixed categories keep the key columns as small integer codes, so equality masks and index
+# lookups compare codes instead of Python strings. They only set the order of the known codes:
+# load_data appends any other code found in the data instead of turning it into NaN
+TYPE_DTYPE = pd.CategoricalDtype(categories=list(dict.fromkeys([*POLICY_TYPES.values(), "Nonref", "Refund"])))
+PS_DTYPE = pd.CategoricalDtype(categories=["PT", "CL", "NO"])
+
+CUSTOM_KEYS = ["type", "ctc_c", "u6_bonus", "ps"]
+KEY_DTYPES = {"type": TYPE_DTYPE, "ctc_c": "Int32", "u6_bonus": "Int32", "ps": PS_DTYPE}
+
+VALUE_COLS = {
+    "budget": ["value_all", "value_ctc"],
+    "poverty": ["spm_all", "spm_u18"],
+    "dists_all": ["mean", "pc_aftertaxinc", "metr_reform"],
+    "params": ["max_c", "bon6", "max_r", "q_age", "thresh", "pir", "pos", "por"],
+}
 
-def load_data(filename):
+# Cache files are written to a temp file in data/ and renamed into place, so gunicorn workers
+# building them at the same time never read a half-written file
+def _write_atomic(path, write):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    os.close(fd)
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tmp_path)
+        raise
+
+# Each CSV is converted to a typed Parquet copy on first load (or when the CSV changes) so later
+# startups skip the CSV parser; the copy records the CSV's (mtime, size) in its metadata and is
+# rebuilt on any mismatch. Fall back to the CSV if pyarrow is missing, data/ is read-only or the
+# Parquet copy is unreadable (it is then removed so the next start rebuilds it)
+def load_data(filename, dtype=None, usecols=None):
     path = os.path.join(CURR_PATH, "data", filename)
-    return pd.read_csv(path)
-
-budget_df = load_data("budget_estimates.csv")
-poverty_df = load_data("poverty_estimates.csv")
-dists_df = load_data("dist_estimates.csv")
-params_df = load_data("params_data.csv")
-
-def filter_data(df, policy, refund, ctc_c, u6_bonus, ps):
-    if policy in ["cl", "biden", "wnm", "fsa", "house25", "senate25"]:
-        lookup = {
-            "cl": "CL",
-            "biden": "Biden",
-            "wnm": "WNM",
-            "fsa": "Romney",
-            "house25": "House25",
-            "senate25": "Senate25"
-        }
-        return df[df["type"] == lookup[policy]]
+    parquet_path = os.path.splitext(path)[0] + ".parquet"
+    # Categorical columns are parsed with inferred categories so no code is lost before
+    # _known_codes_first applies the fixed order
+    csv_dtype = {col: "category" if isinstance(t, pd.CategoricalDtype) else t for col, t in (dtype or {}).items()}
+    st = os.stat(path)
+    source = [st.st_mtime_ns, st.st_size, repr(csv_dtype)]
+    try:
+        df = pd.read_parquet(parquet_path, columns=usecols) if os.path.exists(parquet_path) else None
+        if df is None or df.attrs.get("source") != source:
+            df = pd.read_csv(path, dtype=csv_dtype)
+            df.attrs["source"] = source
+            _write_atomic(parquet_path, lambda tmp_path: df.to_parquet(tmp_path, compression="zstd"))
+            if usecols is not None:
+                df = df[usecols]
+    except (ImportError, OSError):
+        df = pd.read_csv(path, dtype=csv_dtype, usecols=usecols)
+    except ValueError:
+        with contextlib.suppress(OSError):
+            os.remove(parquet_path)
+        df = pd.read_csv(path, dtype=csv_dtype, usecols=usecols)
+    return df.assign(**{col: _known_codes_first(df[col], t) for col, t in (dtype or {}).items() if col in df})
+
+def _known_codes_first(values, dtype):
+    if not isinstance(dtype, pd.CategoricalDtype):
+        return values.astype(dtype)
+    values = values.astype("category")
+    extra = sorted(set(values.cat.categories) - set(dtype.categories))
+    return values.cat.set_categories([*dtype.categories, *extra])
+
+DATA_FILES = ["budget_estimates.csv", "poverty_estimates.csv", "dist_estimates.csv", "params_data.csv"]
+SLICES_PATH = os.path.join(CURR_PATH, "data", "_slices.pkl")
+# Settings build_slices depends on; changing any of them invalidates the snapshot
+SLICES_INPUTS = repr((POLICY_TYPES, VALUE_COLS, KEY_DTYPES, CUSTOM_KEYS))
+
+def build_slices():
+    budget_df = load_data("budget_estimates.csv", dtype=KEY_DTYPES, usecols=CUSTOM_KEYS + VALUE_COLS["budget"])
+    poverty_df = load_data("poverty_estimates.csv", dtype=KEY_DTYPES, usecols=CUSTOM_KEYS + VALUE_COLS["poverty"])
+    dists_df = load_data("dist_estimates.csv", dtype={**KEY_DTYPES, "decile": "category"},
+                         usecols=CUSTOM_KEYS + ["decile"] + VALUE_COLS["dists_all"])
+    params_df = load_data("params_data.csv", dtype=KEY_DTYPES, usecols=CUSTOM_KEYS + VALUE_COLS["params"])
+
+    tables = {
+        "budget": budget_df,
+        "poverty": poverty_df,
+        "dists_all": dists_df[dists_df["decile"] == "ALL"].reset_index(drop=True),
+        "params": params_df,
+    }
+
+    # The named policies never change, so slice them once here instead of re-masking on every callback
+    precomputed = {}
+    for name, df in tables.items():
+        for policy, type_code in POLICY_TYPES.items():
+            precomputed[(name, policy)] = df.loc[df["type"] == type_code, VALUE_COLS[name]].reset_index(drop=True)
+
+    # Custom reforms are looked up on a sorted MultiIndex rather than four chained column masks
+    tables_idx = {name: df.set_index(CUSTOM_KEYS)[VALUE_COLS[name]].sort_index() for name, df in tables.items()}
+    return precomputed, tables_idx
+
+# The built slices are pickled alongside the data and reused until a source CSV, the slicing
+# settings or pandas change;
+# the data fingerprint is returned too so other caches can be keyed on it
+def load_slices():
+    stats = [os.stat(os.path.join(CURR_PATH, "data", f)) for f in DATA_FILES]
+    key = (SLICES_INPUTS, pd.__version__, tuple((st.st_mtime_ns, st.st_size) for st in stats))
+    try:
+        with open(SLICES_PATH, "rb") as f:
+            cached_key, slices = pickle.load(f)
+        if cached_key == key:
+            return key, slices
+    except Exception:
+        pass
+    slices = build_slices()
+    def write(tmp_path):
+        with open(tmp_path, "wb") as f:
+            pickle.dump((key, slices), f, protocol=pickle.HIGHEST_PROTOCOL)
+    try:
+        _write_atomic(SLICES_PATH, write)
+    except OSError:
+        pass
+    return key, slices
+
+DATA_KEY, (PRECOMPUTED, TABLES_IDX) = load_slices()
+DATA_VERSION = hashlib.md5(repr(DATA_KEY).encode()).hexdigest()[:12]
+
+def filter_data(name, policy, refund, ctc_c, u6_bonus, ps):
+    if policy in POLICY_TYPES:
+        return PRECOMPUTED[(name, policy)]
     elif policy == "custom":
-        return df[(df["type"] == refund) & (df["ctc_c"] == ctc_c) & (df["u6_bonus"] == u6_bonus) & (df["ps"] == ps)]
+        df_idx = TABLES_IDX[name]
+        try:
+            return df_idx.loc[[(refund, ctc_c, u6_bonus, ps)]]
+        except KeyError:
+            return df_idx.iloc[:0]
     return pd.DataFrame()
 
+@functools.lru_cache(maxsize=64)
+def extract_values(policy, refund, ctc_c, u6_bonus, ps):
+    vals = {}
+    for name, cols in VALUE_COLS.items():
+        row = filter_data(name, policy, refund, ctc_c, u6_bonus, ps).iloc[0]
+        vals.update(row[cols].to_dict())
+    return vals
+
+# Table styling is fixed, so each table figure is built and validated once, then kept as a plain
+# plotly JSON dict; per call only the cell values are swapped in, without touching go.* classes
+_SUMMARY_TEMPLATE = go.Figure(data=[go.Table(
+    columnorder=[1,2,3,4], columnwidth=[60,14,14,12],
+    header=dict(values=['', 'Baseline Policy', 'Reform Policy', 'Difference'], fill_color='#008CCC', font=dict(color='white', size=14), height=30),
+    cells=dict(values=[[], [], [], []], fill_color='#F9F9F9', font=dict(color='#414141', size=14), height=30, align=['left','center'])
+)])
+_SUMMARY_TEMPLATE = _SUMMARY_TEMPLATE.update_layout(
+    title={"text": 'Comparing Baseline and Reform', 'y':0.9, 'x':0.5, 'xanchor': 'center'}).to_plotly_json()
+
+_PARAM_TEMPLATE = go.Figure(data=[go.Table(
+    columnorder=[1,2,3], columnwidth=[40,30,30],
+    header=dict(values=['', 'Baseline Policy', 'Reform Policy'], fill_color='#008CCC', font=dict(color='white', size=14), height=30),
+    cells=dict(values=[[], [], []], fill_color='#F9F9F9', font=dict(color='#414141', size=13), height=26, align=['left','center'])
+)])
+_PARAM_TEMPLATE = _PARAM_TEMPLATE.update_layout(
+    title={"text": 'Policy Parameters', 'y':0.9, 'x':0.5, 'xanchor': 'center'}).to_plotly_json()
+
+def _fill_table(template, cells):
+    table = template["data"][0]
+    return {"data": [{**table, "cells": {**table["cells"], "values": cells}}], "layout": template["layout"]}
+
+SUMMARY_ROWS = [
+    ('Annual Value of All Child Tax Benefits (2025 $)', 'value_all'),
+    ('Annual Value of Child Tax Credit (2025 $)', 'value_ctc'),
+    ('Average Total Benefit ($)', 'mean'),
+    ('Percent Change in After-Tax Income (%)', 'pc_aftertaxinc'),
+    ('EMTR on Labor (%)', 'metr_reform'),
+    ('SPM Poverty Rate - Total U.S. (%)', 'spm_all'),
+    ('SPM Poverty Rate - Under 18 (%)', 'spm_u18')
+]
+SUMMARY_LABELS = [label for label, _ in SUMMARY_ROWS]
+SUMMARY_KEYS = [key for _, key in SUMMARY_ROWS]
+
 def build_summary_table(base_vals, reform_vals):
-    headers = ['', 'Baseline Policy', 'Reform Policy', 'Difference']
-    rows = [
-        ('Annual Value of All Child Tax Benefits (2025 $)', base_vals['value_all'], reform_vals['value_all']),
-        ('Annual Value of Child Tax Credit (2025 $)', base_vals['value_ctc'], reform_vals['value_ctc']),
-        ('Average Total Benefit ($)', base_vals['mean'], reform_vals['mean']),
-        ('Percent Change in After-Tax Income (%)', base_vals['pc_aftertaxinc'], reform_vals['pc_aftertaxinc']),
-        ('EMTR on Labor (%)', base_vals['metr_reform'], reform_vals['metr_reform']),
-        ('SPM Poverty Rate - Total U.S. (%)', base_vals['spm_all'], reform_vals['spm_all']),
-        ('SPM Poverty Rate - Under 18 (%)', base_vals['spm_u18'], reform_vals['spm_u18'])
-    ]
-    cells = [list(zip(*rows))[0],
-             [v for v in list(zip(*rows))[1]],
-             [v for v in list(zip(*rows))[2]],
-             [round(r - b, 1) for b, r in zip(list(zip(*rows))[1], list(zip(*rows))[2])]]
-
-    fig = go.Figure(data=[go.Table(
-        columnorder=[1,2,3,4], columnwidth=[60,14,14,12],
-        header=dict(values=headers, fill_color='#008CCC', font=dict(color='white', size=14), height=30),
-        cells=dict(values=cells, fill_color='#F9F9F9', font=dict(color='#414141', size=14), height=30, align=['left','center'])
-    )])
-    fig.update_layout(title={"text": 'Comparing Baseline and Reform', 'y':0.9, 'x':0.5, 'xanchor': 'center'})
-    return fig
+    base_col = [base_vals[key] for key in SUMMARY_KEYS]
+    reform_col = [reform_vals[key] for key in SUMMARY_KEYS]
+    diff = np.round(np.array(reform_col, dtype=float) - np.array(base_col, dtype=float), 1).tolist()
+    return _fill_table(_SUMMARY_TEMPLATE, [SUMMARY_LABELS, base_col, reform_col, diff])
 
 def build_param_table(base_vals, reform_vals):
-    headers = ['', 'Baseline Policy', 'Reform Policy']
     rows = [
         ('Maximum Credit Amount', base_vals['max_c'], reform_vals['max_c']),
         ('Bonus Under 6', base_vals['bon6'], reform_vals['bon6']),
@@ -79,21 +225,26 @@ def build_param_table(base_vals, reform_vals):
         ('Phaseout Start', base_vals['pos'], reform_vals['pos']),
         ('Phaseout Rate', base_vals['por'], reform_vals['por'])
     ]
-    cells = [list(zip(*rows))[0], [v for v in list(zip(*rows))[1]], [v for v in list(zip(*rows))[2]]]
+    cells = [list(col) for col in zip(*rows)]
 
-    fig = go.Figure(data=[go.Table(
-        columnorder=[1,2,3], columnwidth=[40,30,30],
-        header=dict(values=headers, fill_color='#008CCC', font=dict(color='white', size=14), height=30),
-        cells=dict(values=cells, fill_color='#F9F9F9', font=dict(color='#414141', size=13), height=26, align=['left','center'])
-    )])
-    fig.update_layout(title={"text": 'Policy Parameters', 'y':0.9, 'x':0.5, 'xanchor': 'center'})
-    return fig
+    return _fill_table(_PARAM_TEMPLATE, cells)
 
 app = dash.Dash(__name__, external_stylesheets=external_stylesheets)
 server = app.server
 
+# Figures are memoized in a Flask cache so gunicorn workers can share hits; set REDIS_URL (and install
+# redis) to use a shared Redis cache, otherwise each worker keeps its own in-memory SimpleCache.
+# Keys are namespaced by DATA_VERSION so a data update never serves old figures, and Redis entries
+# expire after a day so namespaces left by earlier deploys drain away
+if os.environ.get("REDIS_URL"):
+    cache_config = {"CACHE_TYPE": "RedisCache", "CACHE_REDIS_URL": os.environ["REDIS_URL"],
+                    "CACHE_DEFAULT_TIMEOUT": 24 * 60 * 60}
+else:
+    cache_config = {"CACHE_TYPE": "SimpleCache", "CACHE_THRESHOLD": 1000, "CACHE_DEFAULT_TIMEOUT": 0}
+cache = Cache(server, config={**cache_config, "CACHE_KEY_PREFIX": f"ctc-{DATA_VERSION}:"})
+
 app.layout = html.Div([
-    html.Div([html.Img(src=f"data:image/png;base64,{encoded_image}" if encoded_image else "", height=80)]),
+    html.Div([html.Img(src=LOGO_URI, height=80)]),
     html.H3("Child Tax Credit Reform Dashboard"),
 
     html.Label("Baseline Policy"),
@@ -159,6 +310,8 @@ app.layout = html.Div([
 def toggle_custom(reform):
     return {'display': 'block'} if reform == 'custom' else {'display': 'none'}
 
+CUSTOM_INPUTS = {"refund", "ctc_c", "u6_bonus", "ps"}
+
 @app.callback(
     Output("main-graph", "figure"),
     Input("base", "value"), Input("reform", "value"), Input("refund", "value"),
@@ -166,50 +319,26 @@ def toggle_custom(reform):
     Input("tabs", "value")
 )
 def update_graph(base, reform, refund, ctc_c, u6_bonus, ps, tabs):
-    base_bud = filter_data(budget_df, base, refund, ctc_c, u6_bonus, ps)
-    reform_bud = filter_data(budget_df, reform, refund, ctc_c, u6_bonus, ps)
-    base_pov = filter_data(poverty_df, base, refund, ctc_c, u6_bonus, ps)
-    reform_pov = filter_data(poverty_df, reform, refund, ctc_c, u6_bonus, ps)
-    base_fig = filter_data(dists_df, base, refund, ctc_c, u6_bonus, ps)
-    reform_fig = filter_data(dists_df, reform, refund, ctc_c, u6_bonus, ps)
-    base_param = filter_data(params_df, base, refund, ctc_c, u6_bonus, ps)
-    reform_param = filter_data(params_df, reform, refund, ctc_c, u6_bonus, ps)
-
-    base_vals = {
-        'value_all': base_bud['value_all'].values[0],
-        'value_ctc': base_bud['value_ctc'].values[0],
-        'mean': base_fig[base_fig['decile']=="ALL"]['mean'].values[0],
-        'pc_aftertaxinc': base_fig[base_fig['decile']=="ALL"]['pc_aftertaxinc'].values[0],
-        'metr_reform': base_fig[base_fig['decile']=="ALL"]['metr_reform'].values[0],
-        'spm_all': base_pov['spm_all'].values[0],
-        'spm_u18': base_pov['spm_u18'].values[0],
-        'max_c': base_param['max_c'].values[0],
-        'bon6': base_param['bon6'].values[0],
-        'max_r': base_param['max_r'].values[0],
-        'q_age': base_param['q_age'].values[0],
-        'thresh': base_param['thresh'].values[0],
-        'pir': base_param['pir'].values[0],
-        'pos': base_param['pos'].values[0],
-        'por': base_param['por'].values[0],
-    }
+    # The custom dropdowns only feed the figure when the reform is custom: skip their changes otherwise,
+    # and drop their values so every named-policy pair shares one cache entry
+    if reform != "custom":
+        if dash.ctx.triggered_id in CUSTOM_INPUTS:
+            raise PreventUpdate
+        refund = ctc_c = u6_bonus = ps = None
+    return build_figure(base, reform, refund, ctc_c, u6_bonus, ps, tabs)
 
-    reform_vals = {
-        'value_all': reform_bud['value_all'].values[0],
-        'value_ctc': reform_bud['value_ctc'].values[0],
-        'mean': reform_fig[reform_fig['decile']=="ALL"]['mean'].values[0],
-        'pc_aftertaxinc': reform_fig[reform_fig['decile']=="ALL"]['pc_aftertaxinc'].values[0],
-        'metr_reform': reform_fig[reform_fig['decile']=="ALL"]['metr_reform'].values[0],
-        'spm_all': reform_pov['spm_all'].values[0],
-        'spm_u18': reform_pov['spm_u18'].values[0],
-        'max_c': reform_param['max_c'].values[0],
-        'bon6': reform_param['bon6'].values[0],
-        'max_r': reform_param['max_r'].values[0],
-        'q_age': reform_param['q_age'].values[0],
-        'thresh': reform_param['thresh'].values[0],
-        'pir': reform_param['pir'].values[0],
-        'pos': reform_param['pos'].values[0],
-        'por': reform_param['por'].values[0],
-    }
+# Figures depend only on the dropdown state, so repeat selections (e.g. flipping tabs) hit the cache
+@cache.memoize()
+def build_figure(base, reform, refund, ctc_c, u6_bonus, ps, tabs):
+    # Named policies ignore the custom settings, so look them up without those arguments and let
+    # every combination share one extract_values cache entry per policy
+    custom_args = (refund, ctc_c, u6_bonus, ps)
+    named_args = (None, None, None, None)
+    if base == reform and reform != "custom":
+        base_vals = reform_vals = extract_values(base, *named_args)
+    else:
+        base_vals = extract_values(base, *(custom_args if base == "custom" else named_args))
+        reform_vals = extract_values(reform, *(custom_args if reform == "custom" else named_args))
 
     if tabs == "summary_tab":
         return build_summary_table(base_vals, reform_vals)